@@ -3,12 +3,24 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import tempfile
+
+# Give each pytest-xdist worker its own SQLite database so parallel runs don't contend for writes.
+# This has to happen before models is imported, since the engine is created at import time.
+worker_id = os.environ.get("PYTEST_XDIST_WORKER")
+if worker_id:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.gettempdir(), f'test_{worker_id}.db')}"
+
 import pytest
+from types import SimpleNamespace
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from models import Base, NewsArticle, Weather
+from models import Base, NewsArticle, Weather, session
 from app import app
 
+# Keep attributes loaded after commit so tests can read their own instances without a re-fetch
+session.expire_on_commit = False
+
 # In-memory SQLite database for testing
 TEST_DATABASE_URL = "sqlite:///:memory:"
 
@@ -20,4 +32,17 @@ def test_session():
     Base.metadata.create_all(engine) # Create tables
     session = TestingSessionLocal()
     yield session
-    session.close()
\ No newline at end of file
+    session.close()
+
+@pytest.fixture(scope="session", autouse=True)
+def mock_ai():
+    """Stubs out the app's AI calls for the whole session; tests set mock_ai.result to the canned response."""
+    canned = SimpleNamespace(result=None)
+
+    def fake_ai(*args, **kwargs):
+        return canned.result
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("app.get_summary", fake_ai)
+        mp.setattr("app.get_sentiment_and_summary", fake_ai)
+        yield canned
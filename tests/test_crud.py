@@ -1,43 +1,134 @@
-from unittest.mock import patch
+import json
+import os
 import pytest
-from flask import url_for
+from flask import request
+import app as app_module
+import models
 from app import app, session
-from models import CommunityArticle, NewsArticle, create_or_open_index
-from whoosh.writing import AsyncWriter
+app.config["TESTING"] = True # Marks the app as under test once, at import time
+from models import CommunityArticle, NewsArticle, engine, news_article_schema
+from whoosh.filedb.filestore import RamStorage
 
-# Creates a test client
-@pytest.fixture
+# Request body shared by the AI endpoint tests, serialized once instead of per request.
+# The title is the headline of titled_article, chosen so no real or leaked row can share it.
+AI_PAYLOAD = {"title": "Test Title (titled_article fixture)", "content": "Test content of the article."}
+AI_PAYLOAD_BYTES = json.dumps(AI_PAYLOAD).encode()
+
+# Creates a test client shared by every test in the session
+@pytest.fixture(scope="session")
 def client():
-    app.config["TESTING"] = True
     with app.test_client() as client:
         yield client
 
-# Creates and indexes a test article in the database and Whoosh index
+# Serves an in-memory Whoosh index to the app for the whole test session instead of the on-disk one
+@pytest.fixture(scope="session", autouse=True)
+def ram_ix():
+    # Writers stage segments under <tmpdir>/<indexname>.tmp, so keep the name unique per xdist worker
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER", "master")
+    ix = RamStorage().create_index(news_article_schema, indexname=f"test_{worker_id}")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(models, "create_or_open_index", lambda: ix)
+        mp.setattr(app_module, "create_or_open_index", lambda: ix)
+        yield ix
+
+# Binds the app's URL map once so tests can build endpoint paths without pushing a request context each time
+@pytest.fixture(scope="session")
+def url():
+    adapter = app.url_map.bind("localhost")
+
+    def build(endpoint, **values):
+        return adapter.build(endpoint, values)
+
+    return build
+
+# Pays the first-call costs (template compile, DB connection, index reader) once before any test runs
+@pytest.fixture(scope="session", autouse=True)
+def warmup(client, ram_ix):
+    client.get("/") # Renders index.html once so Jinja compiles and caches it
+    session.query(NewsArticle).first() # Opens the pooled DB connection
+    models.create_or_open_index().searcher().close() # Opens a reader on the same index the app searches
+
+# Binds the app session to one connection for the whole module, inside an outer transaction rolled back at module teardown
+@pytest.fixture(scope="module", autouse=True)
+def db_connection():
+    connection = engine.connect()
+    sqlite_conn = connection.connection.driver_connection if engine.dialect.name == "sqlite" else None
+    if sqlite_conn is not None:
+        sqlite_conn.isolation_level = None # pysqlite defers BEGIN, so SAVEPOINTs would escape the outer transaction
+    trans = connection.begin()
+    if sqlite_conn is not None:
+        connection.exec_driver_sql("BEGIN")
+    session.close()
+    session.bind = connection
+    session.join_transaction_mode = "create_savepoint" # Commits inside the app only release a SAVEPOINT
+    yield connection
+
+    # Teardown: discard everything the module wrote and restore the engine binding
+    session.close()
+    session.bind = engine
+    session.join_transaction_mode = "conditional_savepoint"
+    trans.rollback()
+    if sqlite_conn is not None:
+        sqlite_conn.isolation_level = "" # Hand the connection back to the pool with default behaviour
+    connection.close()
+
+# Wraps a test in a SAVEPOINT on the module connection that is rolled back after the test
+@pytest.fixture
+def db_session(db_connection):
+    session.close() # End any SAVEPOINT the session still holds from an earlier request first
+    savepoint = db_connection.begin_nested()
+    yield session
+
+    # Teardown: discard everything the test wrote
+    session.close()
+    savepoint.rollback()
+
+# Field values for the article created by test_article and its search document
+TEST_ARTICLE = {
+    "headline": "Test Article",
+    "summary": "Test summary for search",
+    "link": "http://example.com/test",
+}
+
+# Indexes the test article's search document once per module with a single writer commit
+@pytest.fixture(scope="module")
+def indexed_test_article(ram_ix):
+    writer = ram_ix.writer() # Synchronous writer so no merge thread is spawned
+    writer.add_document(
+        id="test-article", # The DB row is rolled back after every test, so the document can't carry its id
+        headline=TEST_ARTICLE["headline"],
+        summary=TEST_ARTICLE["summary"],
+    )
+    writer.commit(merge=False)
+
+# Creates a test article in the database, backed by the module's indexed search document
 @pytest.fixture
-def test_article():
+def test_article(db_session, indexed_test_article):
+    article = NewsArticle(**TEST_ARTICLE)
+    db_session.add(article)
+    db_session.commit()
+
+    yield article
+
+# Creates one article titled like AI_PAYLOAD, shared by the sentiment + summary tests in this module.
+# It lives in the module's outer transaction, so it is rolled back with everything else.
+@pytest.fixture(scope="module")
+def titled_article(db_connection):
+    session.query(NewsArticle).filter_by(headline=AI_PAYLOAD["title"]).delete() # Hide stale rows so the view can only find this one
     article = NewsArticle(
-        headline="Test Article",
-        summary="Test summary for search",
-        link="http://example.com/test",
+        headline=AI_PAYLOAD["title"],
+        summary="Original summary",
+        link="http://example.com"
     )
     session.add(article)
     session.commit()
 
-    # Index the article in Whoosh
-    ix = create_or_open_index()
-    writer = AsyncWriter(ix)
-    writer.add_document(
-        id=str(article.id),
-        headline=article.headline,
-        summary=article.summary,
-    )
-    writer.commit()
-
     yield article
 
-    # Teardown: remove article from DB and optionally reindex
-    session.delete(article)
-    session.commit()
+# Calls a view function directly inside a POST request context, skipping the WSGI stack for redirect-only checks
+def post_view(endpoint, path, **data):
+    with app.test_request_context(path, method="POST", data=data):
+        return app.view_functions[endpoint](**request.view_args)
 
 # -------------------- Page & CRUD Tests --------------------
 
@@ -45,220 +136,179 @@ def test_article():
 def test_index_page(client):
     response = client.get("/")
     assert response.status_code == 200
-    assert "News Articles" in response.get_data(as_text=True)
+    assert b"News Articles" in response.data
 
 # Test adding a new article
-def test_add_article(client):
-    response = client.post("/add", data={"headline": "New Article", "summary": "Summary", "link": "http://example.com"})
+def test_add_article(db_session):
+    response = post_view("add_article", "/add", headline="New Article", summary="Summary", link="http://example.com")
     assert response.status_code == 302  # Should redirect
-    added = session.query(NewsArticle).filter_by(headline="New Article").first()
+    added = db_session.query(NewsArticle).filter_by(headline="New Article").first()
     assert added is not None
-    session.delete(added)
-    session.commit()
 
 # Test editing an article
-def test_edit_article(client, test_article):
-    response = client.post(f"/edit/{test_article.id}", data={"headline": "Updated", "summary": "Updated summary", "link": test_article.link})
+def test_edit_article(test_article, url):
+    response = post_view("edit_article", url("edit_article", id=test_article.id), headline="Updated", summary="Updated summary", link=test_article.link)
     assert response.status_code == 302
-    updated_article = session.query(NewsArticle).get(test_article.id)
-    assert updated_article.headline == "Updated"
+    session.refresh(test_article) # Reloads the row with a single SELECT
+    assert test_article.headline == "Updated"
 
 # Test deleting an article
-def test_delete_article(client, test_article):
-    response = client.post(f"/delete/{test_article.id}")
+def test_delete_article(test_article, url):
+    response = post_view("delete_article", url("delete_article", id=test_article.id))
     assert response.status_code == 302
-    assert session.query(NewsArticle).get(test_article.id) is None
+    assert session.get(NewsArticle, test_article.id) is None
 
 # Test adding a community article
-def test_add_community_article(client):
-    # Send POST request to teh '/add_community endpoint with test data
-    response = client.post(
+def test_add_community_article(db_session):
+    # Send POST data straight to the add_community_article view with test data
+    response = post_view(
+        "add_community_article",
         "/add_community",
-        data={
-            "username": "TestUser",                     
-            "title": "New Community Article",           
-            "content": "Community content",
-            "link": "http://example.com",
-            "author": "Test Author"
-        }
+        username="TestUser",
+        title="New Community Article",
+        content="Community content",
+        link="http://example.com",
+        author="Test Author"
     )
     assert response.status_code == 302 # Assert the response status code is 302, indicating successful form submission and redirect
 
     # Query the database to check if the article was successfully added
-    added = session.query(CommunityArticle).filter_by(title="New Community Article").first() 
+    added = db_session.query(CommunityArticle).filter_by(title="New Community Article").first() 
     assert added is not None # Assert the queried article exists in the database
 
-    # Cleanup to remove the added article from the database to ensure test isolation
-    session.delete(added)
-    session.commit()
-
 # -------------------- Weather Update Test --------------------
 
 # Test updating the weather
 def test_update_weather(client):
-    response = client.post('/update_weather', follow_redirects=True)
-    assert response.status_code == 200
-    assert b"Weather updated successfully!" in response.data or b"Failed to update weather data" in response.data
+    response = client.post('/update_weather', follow_redirects=False) # Stop at the redirect instead of rendering the homepage
+    assert response.status_code == 302
+
+    # Consume the flashed messages straight from the session cookie so they don't leak into later tests on the shared client
+    with client.session_transaction() as sess:
+        flashes = [message for _category, message in sess.pop('_flashes', [])]
+    assert any("Weather updated successfully!" in message or "Failed to update weather data" in message for message in flashes)
 
 # -------------------- Search Function Tests --------------------
 
 # Test search bar with valid query
 def test_search_function_valid_query(client, test_article):
     response = client.get(f"/search?query=Test")
-    html = response.get_data(as_text=True)
-    assert "Test Article" in html
+    assert b"Test Article" in response.data
 
 # Test search bar with no matching results
 def test_search_function_no_results(client):
     response = client.get("/search?query=NoMatch")
-    html = response.get_data(as_text=True)
-    assert "No articles found for your search." in html  # Ensure flash message appears
+    assert b"No articles found for your search." in response.data  # Ensure flash message appears
 
 # Test search with an empty query
 def test_search_function_empty_query(client):
     response = client.get("/search?query=")
-    html = response.get_data(as_text=True)
-    assert "Please enter a search term." in html  # Ensure warning appears
+    assert b"Please enter a search term." in response.data  # Ensure warning appears
 
 # -------------------- AI Summary Tests --------------------
 
 # Test successful summary generation via the /api/summary route
-def test_summary_success(client):
+def test_summary_success(client, mock_ai):
     mock_summary = "This is a mock summary." # Define a mock summary to return from the AI function
 
-    # Patch the get_summary function to return the mock_summary instead of calling the real AI
-    with patch("app.get_summary", return_value=mock_summary):
-        # Simulate a POST request to the /api/summary endpoint with article data
-        response = client.post("/api/summary", json={
-            "title": "Test Title",
-            "content": "Test content of the article."
-        })
-        
-        data = response.get_json() # Parse the reponse JSON
-        assert response.status_code == 200 # Assert the request was successful
-        assert data["summary"] == mock_summary # Assert the summary matches the mock
+    mock_ai.result = mock_summary # Have the stubbed get_summary return the mock_summary instead of calling the real AI
+    # Simulate a POST request to the /api/summary endpoint with article data
+    response = client.post("/api/summary", data=AI_PAYLOAD_BYTES, content_type="application/json")
+    
+    data = response.get_json() # Parse the reponse JSON
+    assert response.status_code == 200 # Assert the request was successful
+    assert data == {"summary": mock_summary} # Assert the body is exactly the mock summary
 
 # Test when the AI returns an incomplete response (None), triggering a 500 error
-def test_summary_incomplete_response(client):
-    # Patch get_summary to simulate an incomplete AI response (None)
-    with patch("app.get_summary", return_value=None):
-        # Simulate a POST request to the endpoint
-        response = client.post("/api/summary", json={
-            "title": "Test Title",
-            "content": "Test content of the article."
-        })
-
-        data = response.get_json() # Parse the response JSON
-        assert response.status_code == 500 # Should return internal server error
-        assert "error" in data # Confirm that an error message exists
-        assert data["error"] == "Incomplete AI response" # Check for specific error message
+def test_summary_incomplete_response(client, mock_ai):
+    mock_ai.result = None # Simulate an incomplete AI response (None)
+    # Simulate a POST request to the endpoint
+    response = client.post("/api/summary", data=AI_PAYLOAD_BYTES, content_type="application/json")
+
+    data = response.get_json() # Parse the response JSON
+    assert response.status_code == 500 # Should return internal server error
+    assert data == {"error": "Incomplete AI response"} # Check for the specific error message
 
 # Test unexpected internal error during AI summary generation that raises exception
-def test_summary_internal_error(client):
-    # Patch get_summary to raise an exception when called
-    with patch("app.get_summary", side_effect=Exception("Something went wrong")):
-        # Simulate the POST request
-        response = client.post("/api/summary", json={
-            "title": "Test Title",
-            "content": "Test content of the article."
-        })
-        
-        assert response.status_code == 500 # Expect internal server error
-        data = response.get_json() # Parse JSON response
-        assert "error" in data # Ensure error message is present
+def test_summary_internal_error(client, monkeypatch):
+    # Define a mock get_summary that raises an exception when called
+    def mock_get_summary(*args, **kwargs):
+        raise Exception("Something went wrong")
+
+    monkeypatch.setattr("app.get_summary", mock_get_summary)
+    # Simulate the POST request
+    response = client.post("/api/summary", data=AI_PAYLOAD_BYTES, content_type="application/json")
+
+    assert response.status_code == 500 # Expect internal server error
+    data = response.get_json() # Parse JSON response
+    assert data == {"error": "Internal server error"} # Ensure the error message is present
 
 # -------------------- AI Sentiment and Summary Tests --------------------
 
 # Test success case for sentiment + summary with DB update
-def test_sentiment_and_summary_success(client):
+def test_sentiment_and_summary_success(client, db_session, mock_ai, titled_article):
     # Define a mock result to return from the AI function
     mock_result = {
         "summary": "This is a mock AI summary.",
         "sentiment": "Positive"
     }
 
-    # Create a mock article in the test DB to be updated
-    article = NewsArticle(
-        headline="Test Title",
-        summary="Original Summary",
-        link="http://example.com"
-    )
-    session.add(article)
-    session.commit() # Commit the article so it exists in the DB
-
-    # Patch the AI function to return the mock sentiment + summary
-    with patch("app.get_sentiment_and_summary", return_value=mock_result):
-        # Send POST request to the endpoint
-        response = client.post("/api/sentiment-and-summary", json={
-            "title": "Test Title",
-            "content": "Test content of the article."
-        })
-
-        data = response.get_json() # Parse the response
-        assert response.status_code == 200 # Expect request success
-        assert data["sentiment"] == mock_result["sentiment"] # Check returned sentiment
-        assert data["ai_summary"] == mock_result["summary"] # Check returned summary
-
-        # Query the DB to confirm it was updated
-        updated_article = session.query(NewsArticle).filter_by(headline="Test Title").first()
-        assert updated_article.sentiment == mock_result["sentiment"] # Check the updated article's sentiment 
-        assert updated_article.ai_summary == mock_result["summary"] # Check the updated article's summary
+    mock_ai.result = mock_result # Have the stubbed AI function return the mock sentiment + summary
+    # Send POST request to the endpoint
+    response = client.post("/api/sentiment-and-summary", data=AI_PAYLOAD_BYTES, content_type="application/json")
+
+    data = response.get_json() # Parse the response
+    assert response.status_code == 200 # Expect request success
+    assert data == {"sentiment": mock_result["sentiment"], "ai_summary": mock_result["summary"]} # Check returned sentiment and summary
+
+    # Reload the article from the database to confirm the update was actually written
+    updated_article = db_session.get(NewsArticle, titled_article.id)
+    db_session.refresh(updated_article) # Forces a SELECT instead of trusting the in-memory instance
+    assert updated_article.sentiment == mock_result["sentiment"] # Check the updated article's sentiment 
+    assert updated_article.ai_summary == mock_result["summary"] # Check the updated article's summary
 
 # Test unexpected error during AI sentiment + summary generation
-def test_sentiment_and_summary_unexpected_error(client):
-    # Patch to simulate an exception from the AI function
-    with patch("app.get_sentiment_and_summary", side_effect=Exception("Something went wrong")):
-        # Provide mock JSON data simulating an article with a title and content
-        response = client.post("/api/sentiment-and-summary", json={
-            "title": "Test Title",
-            "content": "Test content of the article."
-        })
-
-        assert response.status_code == 500 # Expect internal server error
-        data = response.get_json() # Parse the response
-        assert "error" in data # Ensure error field exists in response
+def test_sentiment_and_summary_unexpected_error(client, monkeypatch):
+    # Define a mock AI function that simulates an exception
+    def mock_get_sentiment_and_summary(*args, **kwargs):
+        raise Exception("Something went wrong")
+
+    monkeypatch.setattr("app.get_sentiment_and_summary", mock_get_sentiment_and_summary)
+    # Provide mock JSON data simulating an article with a title and content
+    response = client.post("/api/sentiment-and-summary", data=AI_PAYLOAD_BYTES, content_type="application/json")
+
+    assert response.status_code == 500 # Expect internal server error
+    data = response.get_json() # Parse the response
+    assert data == {"error": "Internal server error"} # Ensure the error field is in the response
 
 # Test case for AI sentiment + summary generation when the article is not found in the DB
-def test_sentiment_and_summary_article_not_found(client):
+def test_sentiment_and_summary_article_not_found(client, mock_ai):
     # Define a mock result to return from the AI function
     mock_result = {
         "sentiment": "Positive",
         "summary": "This is a mock AI summary."
     }
+    mock_ai.result = mock_result
     # No article is added to the DB here, it is simulating "not found"
-    with patch("app.get_sentiment_and_summary", return_value=mock_result):
-        response = client.post("/api/sentiment-and-summary", json={
-            "title": "Nonexistent Article", # Title not present in DB
-            "content": "Some content"
-        })
+    response = client.post("/api/sentiment-and-summary", json={
+        "title": "Nonexistent Article", # Title not present in DB
+        "content": "Some content"
+    })
 
-        assert response.status_code == 404 #  Should return "not found"
-        data = response.get_json() # Parse the response
-        assert data["error"] == "Article not found"
+    assert response.status_code == 404 #  Should return "not found"
+    data = response.get_json() # Parse the response
+    assert data == {"error": "Article not found"}
 
 # Test case where AI returns incomplete response (in this case a missing sentiment)
-def test_sentiment_and_summary_incomplete_ai_response(client):
+def test_sentiment_and_summary_incomplete_ai_response(client, db_session, mock_ai, titled_article):
     mock_result = {
         "summary": "Partial summary.",
         "sentiment": None # Missing sentiment
     }
 
-    # Add an article that matches the incoming title
-    article = NewsArticle(
-        headline="Test Title",
-        summary="Original summary",
-        link="http://example.com"
-    )
-    session.add(article)
-    session.commit()
-
-    # Patch the AI function to return an incomplete response
-    with patch("app.get_sentiment_and_summary", return_value=mock_result):
-        response = client.post("/api/sentiment-and-summary", json={
-            "title": "Test Title",
-            "content": "Test content"
-        })
+    mock_ai.result = mock_result # Have the stubbed AI function return an incomplete response
+    response = client.post("/api/sentiment-and-summary", data=AI_PAYLOAD_BYTES, content_type="application/json")
 
-        data = response.get_json() # Parse the response
-        assert response.status_code == 500 # Expect internal error due to incomplete data
-        assert data["error"] == "Incomplete AI response" 
\ No newline at end of file
+    data = response.get_json() # Parse the response
+    assert response.status_code == 500 # Expect internal error due to incomplete data
+    assert data == {"error": "Incomplete AI response"} 
\ No newline at end of file